@@ -1,19 +1,24 @@
 # backend/analyzer.py
 
 import ast
+import asyncio
+import hashlib
 import os
-from io import BytesIO
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from itertools import groupby
 import dotenv
 # --- Third-party libraries ---
 try:
-    import networkx as nx
-    from graphviz import Digraph
     from langchain_google_genai import ChatGoogleGenerativeAI
-    from langchain.prompts import PromptTemplate
-    from langchain.chains import LLMChain
+    from langchain_core.output_parsers import StrOutputParser
+    from aiolimiter import AsyncLimiter
+    from cachetools import LRUCache, cached
+    from diskcache import Cache
 except ImportError as e:
     print(f"Error: A required library is not installed ({e}). Please run:")
-    print("pip install networkx graphviz langchain langchain-google-genai")
+    print("pip install langchain langchain-google-genai aiolimiter cachetools diskcache")
     exit(1)
 
 # --- AI Summarization ---
@@ -21,16 +26,25 @@ except ImportError as e:
 # IMPORTANT: Set your Google AI API key here or as an environment variable
  
 
-def generate_ai_summary(code_text: str) -> str:
+# Caps the number of Gemini requests in flight at once across all endpoints.
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "10"))
+_llm_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+# Proactive rate limiting: keep submissions under the Gemini quota instead of
+# hitting 429s and stalling in the client's exponential backoff.
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "10"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "250000"))
+_request_limiter = AsyncLimiter(GEMINI_RPM, 60)
+_token_limiter = AsyncLimiter(GEMINI_TPM, 60)
+
+def _estimate_tokens(text: str) -> int:
     """
-    Generates a natural language summary of the code's purpose using Google's Gemini model.
+    Rough prompt size estimate (about 4 characters per token).
     """
-   
-    if not os.getenv("GOOGLE_API_KEY"):
-        return "Error: GOOGLE_API_KEY is not set. Cannot generate AI summary."
+    return max(1, len(text) // 4)
 
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.4)
-    prompt_template = """
+# Plain str.format template; the code is the only substitution
+_PROMPT_TEMPLATE = """
     You are an expert programmer. Analyze the following Python code and provide a concise, plain-text summary.
     Explain the overall purpose of the code, what each function or class does, and the main logic flow.
 
@@ -39,102 +53,375 @@ def generate_ai_summary(code_text: str) -> str:
 
     Summary:
     """
-    prompt = PromptTemplate(template=prompt_template, input_variables=["code"])
-    chain = LLMChain(llm=llm, prompt=prompt)
+
+# Built once at import and shared by every request
+_LLM_MODEL = "gemini-2.5-flash"
+_LLM_TEMPERATURE = 0.4
+_LLM = ChatGoogleGenerativeAI(model=_LLM_MODEL, temperature=_LLM_TEMPERATURE) if os.getenv("GOOGLE_API_KEY") else None
+# LCEL pipeline that yields the reply text directly, both invoked and streamed
+_SUMMARY_CHAIN = _LLM | StrOutputParser() if _LLM is not None else None
+
+# Successful summaries persist on disk keyed by content hash, so identical code
+# never costs a second Gemini roundtrip, even across restarts.
+_summary_cache = Cache(os.getenv("SUMMARY_CACHE_DIR", "/tmp/yarn_llm_cache"), size_limit=512 << 20)
+# A summary also depends on the model settings and the prompt, so they are part of
+# the key; changing any of them stops older entries from being served.
+_SUMMARY_KEY_PREFIX = (
+    f"{_LLM_MODEL}:{_LLM_TEMPERATURE}:"
+    f"{hashlib.blake2b(_PROMPT_TEMPLATE.encode(), digest_size=8).hexdigest()}:"
+)
+
+def _summary_key(code_text: str) -> str:
+    return _SUMMARY_KEY_PREFIX + source_hash(code_text)
+
+async def generate_ai_summary_async(code_text: str) -> str:
+    """
+    Generates a natural language summary of the code's purpose using Google's Gemini model.
+    The request is awaited on the event loop, so concurrent analyses don't block each other.
+    """
+   
+    if _SUMMARY_CHAIN is None:
+        return "Error: GOOGLE_API_KEY is not set. Cannot generate AI summary."
+
+    # diskcache does blocking SQLite I/O, so keep it off the event loop
+    summary_key = _summary_key(code_text)
+    cached_summary = await asyncio.to_thread(_summary_cache.get, summary_key)
+    if cached_summary is not None:
+        return cached_summary
 
     try:
-        response = chain.invoke({"code": code_text})
-        return response.get('text', 'Failed to get summary from AI response.')
+        # A single prompt can never need more than the whole per-minute budget
+        await _token_limiter.acquire(min(_estimate_tokens(code_text), GEMINI_TPM))
+        async with _request_limiter, _llm_semaphore:
+            summary = await _SUMMARY_CHAIN.ainvoke(_PROMPT_TEMPLATE.format(code=code_text))
+        if not summary:
+            return 'Failed to get summary from AI response.'
+        await asyncio.to_thread(_summary_cache.set, summary_key, summary)
+        return summary
     except Exception as e:
         return f"Could not generate AI summary: {e}"
 
+# Queue sentinel marking the end of a streamed summary
+_STREAM_END = object()
+
+async def stream_ai_summary(code_text: str):
+    """
+    Streams the Gemini summary as text chunks as they are generated, under the same
+    rate limits as generate_ai_summary_async. A cached summary is yielded as a single
+    chunk. Failures raise RuntimeError so callers can report them apart from the text.
+    """
+    if _SUMMARY_CHAIN is None:
+        raise RuntimeError("GOOGLE_API_KEY is not set. Cannot generate AI summary.")
+
+    # diskcache does blocking SQLite I/O, so keep it off the event loop
+    summary_key = _summary_key(code_text)
+    cached_summary = await asyncio.to_thread(_summary_cache.get, summary_key)
+    if cached_summary is not None:
+        yield cached_summary
+        return
+
+    # The upstream pull runs in its own task and feeds a queue, so the shared Gemini
+    # slot is released as soon as Gemini finishes, however slowly the client reads.
+    queue = asyncio.Queue()
+
+    async def pump():
+        await _token_limiter.acquire(min(_estimate_tokens(code_text), GEMINI_TPM))
+        async with _request_limiter, _llm_semaphore:
+            async for chunk in _SUMMARY_CHAIN.astream(_PROMPT_TEMPLATE.format(code=code_text)):
+                if chunk:
+                    queue.put_nowait(chunk)
+
+    def on_pump_done(task):
+        # Mark a failure as retrieved even if the reader has gone; it is re-raised below
+        if not task.cancelled():
+            task.exception()
+        queue.put_nowait(_STREAM_END)
+
+    pump_task = asyncio.create_task(pump())
+    pump_task.add_done_callback(on_pump_done)
+    chunks = []
+    try:
+        while (chunk := await queue.get()) is not _STREAM_END:
+            chunks.append(chunk)
+            yield chunk
+        await pump_task
+    except Exception as e:
+        raise RuntimeError(f"Could not generate AI summary: {e}") from e
+    finally:
+        # No-op once the pull has finished; otherwise a disconnected reader frees its slot
+        pump_task.cancel()
+    if chunks:
+        await asyncio.to_thread(_summary_cache.set, summary_key, "".join(chunks))
+
 # --- Code Structure and Flowchart Logic ---
 
-class CodeAnalyzer(ast.NodeVisitor):
+# Node types compared by identity in the analyzer's hot paths
+_FUNCTION_DEF = ast.FunctionDef
+_NAME = ast.Name
+_ATTRIBUTE = ast.Attribute
+_CONSTANT = ast.Constant
+_COMPARE = ast.Compare
+
+# Fields holding nested statements (or except handlers / match cases that hold them)
+_STATEMENT_BLOCKS = ("body", "handlers", "orelse", "finalbody", "cases")
+
+# Constant types whose repr() is exactly what ast.unparse would produce
+_SIMPLE_CONSTANTS = (int, str, bool, type(None))
+
+_COMPARE_OPS = {
+    ast.Eq: "==", ast.NotEq: "!=", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=",
+    ast.Is: "is", ast.IsNot: "is not", ast.In: "in", ast.NotIn: "not in",
+}
+
+def _cheap_atom(n):
+    """
+    Renders names, dotted attributes and simple constants directly, or returns None.
+    """
+    t = type(n)
+    if t is _NAME:
+        return n.id
+    if t is _ATTRIBUTE:
+        value = n.value
+        if type(value) is _NAME or type(value) is _ATTRIBUTE:
+            base = _cheap_atom(value)
+            if base is not None:
+                return f"{base}.{n.attr}"
+        return None
+    if t is _CONSTANT and n.kind is None and type(n.value) in _SIMPLE_CONSTANTS:
+        return repr(n.value)
+    return None
+
+def _cheap_unparse(n):
+    """
+    Fast path for ast.unparse covering the common expression shapes, skipping the
+    _Unparser machinery. Anything more complex falls back to ast.unparse.
+    """
+    text = _cheap_atom(n)
+    if text is not None:
+        return text
+    if type(n) is _COMPARE:
+        parts = [_cheap_atom(n.left)]
+        for op, comparator in zip(n.ops, n.comparators):
+            parts.append(_COMPARE_OPS[type(op)])
+            parts.append(_cheap_atom(comparator))
+        if None not in parts:
+            return " ".join(parts)
+    return ast.unparse(n)
+
+class CodeAnalyzer:
     """
     Traverses the AST to extract detailed information for the flowchart.
     """
     def __init__(self):
         self.structure = {"functions": {}}
 
+    def visit(self, tree):
+        """
+        Collects every function in the tree, including methods and nested functions.
+        Only statement blocks are descended into, so expression subtrees are never visited.
+        Functions are collected in source order.
+        """
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if type(node) is _FUNCTION_DEF:
+                self.visit_FunctionDef(node)
+            children = []
+            for block in _STATEMENT_BLOCKS:
+                children.extend(getattr(node, block, ()))
+            stack.extend(reversed(children))
+
     def visit_FunctionDef(self, node):
         args = [a.arg for a in node.args.args]
         flow = []
+        unparse = _cheap_unparse
         for body_item in node.body:
-            if isinstance(body_item, ast.If):
-                condition = ast.unparse(body_item.test)
-                flow.append(f"Decision: if {condition}")
-            elif isinstance(body_item, ast.For):
-                target = ast.unparse(body_item.target)
-                iterator = ast.unparse(body_item.iter)
-                flow.append(f"Loop: for {target} in {iterator}")
-            elif isinstance(body_item, ast.While):
-                condition = ast.unparse(body_item.test)
-                flow.append(f"Loop: while {condition}")
-            elif isinstance(body_item, ast.Return):
-                if body_item.value:
-                    value = ast.unparse(body_item.value)
-                    flow.append(f"Return {value}")
-                else:
+            match body_item:
+                case ast.If(test=test):
+                    flow.append(f"Decision: if {unparse(test)}")
+                case ast.For(target=target, iter=iterator):
+                    flow.append(f"Loop: for {unparse(target)} in {unparse(iterator)}")
+                case ast.While(test=test):
+                    flow.append(f"Loop: while {unparse(test)}")
+                case ast.Return(value=None):
                     flow.append("Return")
+                case ast.Return(value=value):
+                    flow.append(f"Return {unparse(value)}")
         self.structure["functions"][node.name] = {"args": args, "flow": flow}
-        self.generic_visit(node)
+
+@dataclass(slots=True)
+class FlowArrays:
+    """
+    Flowchart model stored as parallel lists, one entry per node, with edges as
+    pairs of node indices. Function name and arguments are kept once per cluster
+    in cluster_meta rather than on every node.
+    """
+    node_ids: list[str] = field(default_factory=list)
+    labels: list[str] = field(default_factory=list)
+    shapes: list[str] = field(default_factory=list)
+    fillcolors: list[str | None] = field(default_factory=list)
+    subgraphs: list[str] = field(default_factory=list)
+    edges: list[tuple[int, int]] = field(default_factory=list)
+    cluster_meta: dict[str, tuple[str, list[str]]] = field(default_factory=dict)
+
+    def add_node(self, node_id, label, shape, subgraph, fillcolor=None):
+        self.node_ids.append(node_id)
+        self.labels.append(label)
+        self.shapes.append(shape)
+        self.fillcolors.append(fillcolor)
+        self.subgraphs.append(subgraph)
+        return len(self.node_ids) - 1
 
 def build_graph_model(structure):
     """
-    Builds a NetworkX DiGraph model from the extracted code structure.
+    Builds a FlowArrays model from the extracted code structure.
     """
-    G = nx.DiGraph()
+    flow_arrays = FlowArrays()
+    add_node = flow_arrays.add_node
+    edges = flow_arrays.edges
+    cluster_meta = flow_arrays.cluster_meta
     for name, details in structure.get('functions', {}).items():
         subgraph_name = f'cluster_func_{name}'
-        func_start_id = f"func_{name}_start"
-        G.add_node(func_start_id, label='Start', shape='ellipse', fillcolor='palegreen', subgraph=subgraph_name, func_name=name, func_args=details['args'])
-        last_node_id = func_start_id
+        cluster_meta[subgraph_name] = (name, details['args'])
+        last_node = add_node(f"func_{name}_start", 'Start', 'ellipse', subgraph_name, fillcolor='palegreen')
         flow = details.get('flow', [])
         if not flow:
-            empty_node_id = f"func_{name}_empty"
-            G.add_node(empty_node_id, label='No operations', shape='plaintext', subgraph=subgraph_name)
-            G.add_edge(last_node_id, empty_node_id)
-            last_node_id = empty_node_id
+            empty_node = add_node(f"func_{name}_empty", 'No operations', 'plaintext', subgraph_name)
+            edges.append((last_node, empty_node))
+            last_node = empty_node
         else:
             for i, step in enumerate(flow):
                 step_id = f"func_{name}_step_{i}"
                 if step.startswith("Decision"):
-                    G.add_node(step_id, label=step.replace("Decision: ", ""), shape='diamond', fillcolor='khaki', subgraph=subgraph_name)
+                    step_node = add_node(step_id, step.replace("Decision: ", ""), 'diamond', subgraph_name, fillcolor='khaki')
                 else:
-                    G.add_node(step_id, label=step, shape='box', subgraph=subgraph_name)
-                G.add_edge(last_node_id, step_id)
-                last_node_id = step_id
-        func_end_id = f"func_{name}_end"
-        G.add_node(func_end_id, label='End', shape='ellipse', fillcolor='lightcoral', subgraph=subgraph_name)
-        G.add_edge(last_node_id, func_end_id)
-    return G
-
-def create_logic_flowchart(graph):
-    """
-    Creates a Graphviz flowchart from a NetworkX graph model.
-    """
-    dot = Digraph('CodeFlow', format='png')
-    dot.attr('node', style='rounded,filled', fillcolor='white')
-    dot.attr(rankdir='TB', splines='ortho', labelloc='t', label='Code Logic Flowchart')
-    dot.attr(fontname="Helvetica")
-    subgraph_clusters = {}
-    if not graph.nodes:
-        dot.node("main", "No functions found to map.")
-    for node_id, attrs in graph.nodes(data=True):
-        subgraph_name = attrs.get('subgraph')
-        if subgraph_name and subgraph_name not in subgraph_clusters:
-            if subgraph_name.startswith('cluster_func'):
-                cluster = Digraph(subgraph_name)
-                func_name = attrs.get('func_name', '')
-                func_args = attrs.get('func_args', [])
-                cluster.attr(label=f"Function: {func_name}({', '.join(func_args)})", style='rounded')
-                subgraph_clusters[subgraph_name] = cluster
-        container = subgraph_clusters.get(subgraph_name, dot)
-        node_attrs = {k: v for k, v in attrs.items() if k not in ['subgraph', 'func_name', 'func_args']}
-        container.node(node_id, **node_attrs)
-    for cluster in subgraph_clusters.values():
-        dot.subgraph(cluster)
-    for u, v in graph.edges():
-        dot.edge(u, v)
-    return dot
\ No newline at end of file
+                    step_node = add_node(step_id, step, 'box', subgraph_name)
+                edges.append((last_node, step_node))
+                last_node = step_node
+        end_node = add_node(f"func_{name}_end", 'End', 'ellipse', subgraph_name, fillcolor='lightcoral')
+        edges.append((last_node, end_node))
+    return flow_arrays
+
+# --- DOT Emission ---
+
+_DOT_HEADER = (
+    'digraph CodeFlow {\n'
+    '\tnode [fillcolor=white style="rounded,filled"]\n'
+    '\tlabel="Code Logic Flowchart" labelloc=t rankdir=TB splines=ortho\n'
+    '\tfontname=Helvetica\n'
+)
+_EMPTY_DOT_SOURCE = _DOT_HEADER + '\tmain [label="No functions found to map."]\n}\n'
+
+def _quote(text):
+    """
+    Quotes a string as a DOT ID, escaping backslashes and double quotes.
+    """
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _dot_node(node_id, label, shape, fillcolor=None):
+    if fillcolor:
+        return f'\t\t{_quote(node_id)} [label={_quote(label)} fillcolor={fillcolor} shape={shape}]\n'
+    return f'\t\t{_quote(node_id)} [label={_quote(label)} shape={shape}]\n'
+
+def _dot_cluster_open(subgraph_name, func_name, func_args):
+    label = f"Function: {func_name}({', '.join(func_args)})"
+    return f'\tsubgraph {_quote(subgraph_name)} {{\n\t\tlabel={_quote(label)} style=rounded\n'
+
+def _build_cluster(flow_arrays, subgraph_name, indices):
+    """
+    Builds the DOT subgraph text for one function from its node indices.
+    """
+    node_ids = flow_arrays.node_ids
+    labels = flow_arrays.labels
+    shapes = flow_arrays.shapes
+    fillcolors = flow_arrays.fillcolors
+    parts = [_dot_cluster_open(subgraph_name, *flow_arrays.cluster_meta[subgraph_name])]
+    parts.extend(_dot_node(node_ids[i], labels[i], shapes[i], fillcolors[i]) for i in indices)
+    parts.append('\t}\n')
+    return "".join(parts)
+
+def create_logic_flowchart(flow_arrays):
+    """
+    Emits the DOT source for a FlowArrays model.
+    """
+    node_ids = flow_arrays.node_ids
+    if not node_ids:
+        return _EMPTY_DOT_SOURCE
+    # Each function's nodes are contiguous, so grouping consecutive indices yields one cluster per function
+    parts = [_DOT_HEADER]
+    parts.extend(
+        _build_cluster(flow_arrays, name, group)
+        for name, group in groupby(range(len(node_ids)), key=flow_arrays.subgraphs.__getitem__)
+    )
+    parts.extend(f'\t{_quote(node_ids[u])} -> {_quote(node_ids[v])}\n' for u, v in flow_arrays.edges)
+    parts.append('}\n')
+    return "".join(parts)
+
+def _render_png(dot_source):
+    """
+    Renders DOT source to PNG bytes by piping it through the Graphviz `dot` executable.
+    """
+    try:
+        result = subprocess.run(['dot', '-Tpng'], input=dot_source.encode(), capture_output=True, check=True)
+    except FileNotFoundError:
+        raise RuntimeError("Graphviz 'dot' executable not found. Is it installed and in your system's PATH?") from None
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Graphviz failed to render the flowchart: {e.stderr.decode(errors='replace').strip()}") from None
+    return result.stdout
+
+# --- Cached Analysis Pipeline ---
+
+def source_hash(code_text: str) -> str:
+    """
+    Returns a short content hash of the text, the basis of the summary and flowchart cache keys.
+    """
+    return hashlib.blake2b(code_text.encode(), digest_size=16).hexdigest()
+
+# Flowchart ids are served with long-lived immutable caching, so they must change
+# whenever the drawing does. Bump this with any change to the analyzer or DOT output.
+FLOWCHART_RENDERER_VERSION = 1
+_FLOWCHART_ID_PREFIX = (
+    f"{FLOWCHART_RENDERER_VERSION}:"
+    f"{hashlib.blake2b(_DOT_HEADER.encode(), digest_size=8).hexdigest()}:"
+)
+
+def flowchart_id_for(code_text: str) -> str:
+    """
+    Returns the flowchart id for the code: its content hash salted with the renderer version.
+    """
+    return source_hash(_FLOWCHART_ID_PREFIX + code_text)
+
+# Keyed by flowchart id alone so rendered flowcharts can be served back by id.
+# The cache is in-process memory: a flowchart id only resolves on the worker that
+# rendered it, so the API must run as a single process (one uvicorn worker).
+ANALYSIS_CACHE_SIZE = 256
+_analysis_cache = LRUCache(maxsize=ANALYSIS_CACHE_SIZE)
+_analysis_cache_lock = threading.Lock()
+
+@cached(_analysis_cache, key=lambda code_hash, code_text: code_hash, lock=_analysis_cache_lock)
+def _analyze_cached(code_hash, code_text):
+    """
+    Parses the code and renders its flowchart, memoized by content hash so that
+    re-submitting the same snippet skips parsing, AST traversal and Graphviz.
+    Returns a (structure, dot_source, png_bytes) tuple.
+    """
+    tree = ast.parse(code_text)
+    analyzer = CodeAnalyzer()
+    analyzer.visit(tree)
+    code_structure = analyzer.structure
+
+    dot_source = create_logic_flowchart(build_graph_model(code_structure))
+
+    png_data = _render_png(dot_source)
+    if not png_data:
+        raise RuntimeError("Graphviz returned empty data. Is it installed and in your system's PATH?")
+
+    return code_structure, dot_source, png_data
+
+def get_cached_flowchart(code_hash):
+    """
+    Returns the rendered PNG for a previously analyzed hash, or None if it isn't cached.
+    """
+    with _analysis_cache_lock:
+        entry = _analysis_cache.get(code_hash)
+    return entry[2] if entry is not None else None
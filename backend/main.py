@@ -1,15 +1,17 @@
-import base64
-from io import BytesIO
-from fastapi import FastAPI
-from pydantic import BaseModel
+import asyncio
+import json
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
 # Import all the necessary functions and classes from your analyzer script
-from analyzer import generate_ai_summary, CodeAnalyzer, build_graph_model, create_logic_flowchart, ast
+from analyzer import generate_ai_summary_async, stream_ai_summary, flowchart_id_for, _analyze_cached, get_cached_flowchart, MAX_CONCURRENCY, ANALYSIS_CACHE_SIZE
 
 # Initialize the FastAPI app
-app = FastAPI()
+# orjson serializes responses faster than the stdlib encoder
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # --- CORS Configuration ---
 frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:5173')
@@ -35,44 +37,109 @@ class CodePayload(BaseModel):
 
 class AnalysisResult(BaseModel):
     summary: str
-    flowchart_base64: str | None
+    flowchart_id: str | None
     error: str | None
 
-# --- API Endpoint ---
-@app.post("/analyze", response_model=AnalysisResult)
-def analyze_code_endpoint(payload: CodePayload):
+class BatchPayload(BaseModel):
+    # Larger batches would evict their own flowcharts before the client could fetch them
+    files: list[CodePayload] = Field(max_length=ANALYSIS_CACHE_SIZE)
+
+class BatchResult(BaseModel):
+    results: list[AnalysisResult]
+
+# --- Analysis Pipeline ---
+async def _analyze_one_async(code: str) -> AnalysisResult:
     """
-    Analyzes a piece of Python code to generate a summary and a flowchart.
-    This is a synchronous endpoint because it performs CPU/IO-bound tasks.
+    Generates the summary and flowchart for one piece of code.
+    The Gemini call is awaited while the CPU-bound flowchart rendering runs in a
+    worker thread, so neither blocks the event loop.
     """
     try:
-        # 1. Generate the AI-powered natural language summary
-        summary = generate_ai_summary(payload.code)
-
-        # 2. Parse the code to generate the flowchart
-        tree = ast.parse(payload.code)
-        analyzer = CodeAnalyzer()
-        analyzer.visit(tree)
-        code_structure = analyzer.structure
-        
-        graph_model = build_graph_model(code_structure)
-        dot_obj = create_logic_flowchart(graph_model)
-        
-        if dot_obj is None:
-             raise ValueError("Failed to generate flowchart object from the graph model.")
-        
-        # 3. Convert the flowchart object to a Base64 image string
-        png_data = dot_obj.pipe(format='png')
-        if not png_data:
-            raise RuntimeError("Graphviz returned empty data. Is it installed and in your system's PATH?")
-            
-        img_buffer = BytesIO(png_data)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
+        # 1. Generate the AI-powered natural language summary and, concurrently,
+        #    parse the code and render the flowchart (cached by flowchart id)
+        flowchart_id = flowchart_id_for(code)
+        summary, _ = await asyncio.gather(
+            generate_ai_summary_async(code),
+            asyncio.to_thread(_analyze_cached, flowchart_id, code),
+        )
         
-        # 4. Return the successful result
-        return AnalysisResult(summary=summary, flowchart_base64=img_base64, error=None)
+        # 2. Return the successful result; the PNG itself is served by /flowchart/{flowchart_id}
+        return AnalysisResult(summary=summary, flowchart_id=flowchart_id, error=None)
 
     except Exception as e:
         # Catch any error during the process (Syntax, Network, Graphviz, etc.)
         # and return a structured error message.
-        return AnalysisResult(summary="", flowchart_base64=None, error=f"An unexpected error occurred: {e}")
\ No newline at end of file
+        return AnalysisResult(summary="", flowchart_id=None, error=f"An unexpected error occurred: {e}")
+
+# --- API Endpoints ---
+@app.post("/analyze", response_model=AnalysisResult)
+async def analyze_code_endpoint(payload: CodePayload):
+    """
+    Analyzes a piece of Python code to generate a summary and a flowchart.
+    """
+    return await _analyze_one_async(payload.code)
+
+@app.post("/analyze_batch", response_model=BatchResult)
+async def analyze_batch_endpoint(payload: BatchPayload):
+    """
+    Analyzes several files concurrently, at most MAX_CONCURRENCY at a time.
+    Results are returned in the same order as the submitted files.
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def one(file: CodePayload) -> AnalysisResult:
+        async with sem:
+            return await _analyze_one_async(file.code)
+
+    outcomes = await asyncio.gather(*(one(f) for f in payload.files), return_exceptions=True)
+    results = [
+        outcome if isinstance(outcome, AnalysisResult)
+        else AnalysisResult(summary="", flowchart_id=None, error=f"An unexpected error occurred: {outcome}")
+        for outcome in outcomes
+    ]
+    return BatchResult(results=results)
+
+@app.post("/analyze_stream")
+async def analyze_stream_endpoint(payload: CodePayload):
+    """
+    Streams the summary as Server-Sent Events while the flowchart renders in the background.
+    Each event carries {"token": ...}; the last one carries the flowchart_id (or an error),
+    and the PNG is then fetched from /flowchart/{flowchart_id}. A failed summary is sent
+    as an {"error": ...} event before the flowchart result.
+    """
+    flowchart_id = flowchart_id_for(payload.code)
+
+    async def event_stream():
+        flowchart_task = asyncio.create_task(asyncio.to_thread(_analyze_cached, flowchart_id, payload.code))
+        # Mark a render failure as retrieved even if the client disconnects before we await it
+        flowchart_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            try:
+                async for token in stream_ai_summary(payload.code):
+                    yield f"data: {json.dumps({'token': token})}\n\n"
+            except Exception as e:
+                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            try:
+                await flowchart_task
+                final = {"flowchart_id": flowchart_id}
+            except Exception as e:
+                final = {"error": f"An unexpected error occurred: {e}"}
+            yield f"data: {json.dumps(final)}\n\n"
+        finally:
+            # No-op once the render has finished; otherwise stop waiting on it
+            flowchart_task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/flowchart/{flowchart_id}")
+def flowchart_endpoint(flowchart_id: str):
+    """
+    Serves the PNG flowchart rendered by /analyze as raw image bytes.
+    Flowcharts live in this process's LRU cache, so ids only resolve when the API runs
+    as a single worker and until the entry is evicted.
+    """
+    png_data = get_cached_flowchart(flowchart_id)
+    if png_data is None:
+        raise HTTPException(status_code=404, detail="Flowchart not found. Re-submit the code to regenerate it.")
+    # The id covers both the code and the renderer version, so its image never changes
+    return Response(content=png_data, media_type="image/png", headers={"Cache-Control": "public, max-age=31536000, immutable"})
@@ -1,7 +1,8 @@
 import { useState } from 'react';
-import axios from 'axios';
 import './App.css';
 
+const API_URL = import.meta.env.VITE_API_URL || 'http://127.0.0.1:8000';
+
 function App() {
   const [code, setCode] = useState('');
   const [result, setResult] = useState(null);
@@ -14,17 +15,44 @@ function App() {
     setError('');
     setResult(null);
 
-    const API_URL = import.meta.env.VITE_API_URL || 'http://127.0.0.1:8000'; 
-
     try {
-      const response = await axios.post(`${API_URL}/analyze`, {
-        code: code,
+      // The summary arrives as Server-Sent Events so it can be shown as it is generated
+      const response = await fetch(`${API_URL}/analyze_stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ code: code }),
       });
+      if (!response.ok) {
+        throw new Error(`Server responded with ${response.status}`);
+      }
 
-      if (response.data.error) {
-        setError(response.data.error);
-      } else {
-        setResult(response.data);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let summary = '';
+      setResult({ summary: '', flowchart_id: null });
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+          if (!event.startsWith('data: ')) continue;
+          const data = JSON.parse(event.slice('data: '.length));
+          if (data.token) {
+            summary += data.token;
+            setResult((prev) => ({ ...prev, summary: summary }));
+          }
+          if (data.flowchart_id) {
+            setResult((prev) => ({ ...prev, flowchart_id: data.flowchart_id }));
+          }
+          if (data.error) {
+            setError(data.error);
+          }
+        }
       }
     } catch (err) {
       setError('Failed to connect to the analysis server. Is it running?');
@@ -65,13 +93,15 @@ function App() {
                 <h2>AI Summary</h2>
                 <pre>{result.summary}</pre>
               </div>
-              <div className="flowchart-section">
-                <h2>Flowchart</h2>
-                <img
-                  src={`data:image/png;base64,${result.flowchart_base64}`}
-                  alt="Generated Code Flowchart"
-                />
-              </div>
+              {result.flowchart_id && (
+                <div className="flowchart-section">
+                  <h2>Flowchart</h2>
+                  <img
+                    src={`${API_URL}/flowchart/${result.flowchart_id}`}
+                    alt="Generated Code Flowchart"
+                  />
+                </div>
+              )}
             </div>
           )}
         </div>